@@ -0,0 +1,247 @@
+import copy
+import glob
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import cube
+import data_loader
+import export
+import filter_index
+import map_data
+import metrics
+
+# QUERY BACKEND: "pandas" (whole data in memory) or "duckdb" (queries over parquet files)
+BACKEND = os.environ.get('KING_COUNTY_BACKEND', 'pandas')
+
+# parquet files queried by the duckdb backend, can be a glob of several years of sales;
+# by default the parquet copy of the csv file
+PARQUET_FILES = os.environ.get('KING_COUNTY_PARQUET', data_loader.PARQUET_PATH)
+
+# masks of the recent selections kept by the pandas backend: the sidebar asks for the same
+# partial selections several times per rerun
+MASK_CACHE_SIZE = 16
+
+# Both backends answer the same queries. A selection is a metrics.filter_key tuple
+# (years, bedrooms, floors, sqft range or None); empty lists mean "no filter".
+
+
+# version of the data behind the backend (changes when the files change)
+def data_version(backend=BACKEND):
+    if backend == 'duckdb' and PARQUET_FILES != data_loader.PARQUET_PATH:
+        paths = glob.glob(PARQUET_FILES)
+        if not paths:
+            raise FileNotFoundError(f"No parquet files match KING_COUNTY_PARQUET={PARQUET_FILES!r}")
+        return max(os.path.getmtime(path) for path in paths)
+    return os.path.getmtime(data_loader.HOUSE_DATA_PATH)
+
+
+# (id, date) pairs of the sales in the data files of the backend (without the ingested batches)
+def data_keys(backend=BACKEND):
+    if backend == 'duckdb' and PARQUET_FILES != data_loader.PARQUET_PATH:
+        import duckdb  # optional dependency, only needed for this backend
+
+        return duckdb.connect().execute(
+            f"SELECT id, date FROM read_parquet({DuckDBBackend._quote(PARQUET_FILES)})").df()
+    return data_loader.load_app_data()[['id', 'date']]
+
+
+def create_backend(backend=BACKEND):
+    if backend == 'pandas':
+        return PandasBackend(data_loader.load_app_data())
+    if backend == 'duckdb':
+        if PARQUET_FILES == data_loader.PARQUET_PATH:
+            data_loader.ensure_parquet()
+        return DuckDBBackend(PARQUET_FILES)
+    raise ValueError(f"Unknown query backend: {backend!r} (expected 'pandas' or 'duckdb')")
+
+
+# data of the pandas backend, replaced as a whole when new sales are appended
+# so a query never mixes the rows of one version with the index of another
+class _PandasData:
+    def __init__(self, df, index, monthly_cube, overall_sums):
+        self.df = df
+        self.index = index
+        self.monthly_cube = monthly_cube
+        self.overall_sums = overall_sums
+        # masks of the recent selections, dropped with this version of the data
+        self._masks = OrderedDict()
+        self._lock = threading.Lock()  # sessions run in separate threads
+
+    def mask(self, selection):
+        with self._lock:
+            if selection in self._masks:
+                self._masks.move_to_end(selection)
+                return self._masks[selection]
+        years, bedrooms, floors, sqft_range = selection
+        mask = self.index.select(years, bedrooms, floors, sqft_range)
+        with self._lock:
+            self._masks[selection] = mask
+            while len(self._masks) > MASK_CACHE_SIZE:
+                self._masks.popitem(last=False)
+        return mask
+
+
+# whole data in a DataFrame, filtered with the filter index, monthly sums from the cube
+class PandasBackend:
+    def __init__(self, df):
+        self._data = _PandasData(df, filter_index.FilterIndex(df), cube.MonthlyCube(df), metrics.monthly_sums(df))
+        self.batches = set()  # ingested batch files already appended (see ingest.py)
+        self.generation = 0  # number of appends, part of the cache keys of the results
+
+    @property
+    def df(self):
+        return self._data.df
+
+    def rows(self, selection):
+        data = self._data
+        return data.df[data.mask(selection)]
+
+    def values(self, column, selection=None):
+        data = self._data
+        return data.index.values(column, None if selection is None else data.mask(selection))
+
+    def sqft_bounds(self, selection):
+        data = self._data
+        return data.index.sqft_bounds(data.mask(selection))
+
+    # only the date column of the selected rows is taken, not the whole frame
+    def summary(self, selection):
+        data = self._data
+        dates = data.df['date'][data.mask(selection)]
+        return {'records': len(dates), 'first_date': dates.min(), 'last_date': dates.max()}
+
+    # the sums of the whole data are kept up to date by append(), other selections are summed
+    # from the cube cells instead of the rows
+    def monthly_sums(self, selection):
+        data = self._data
+        if selection == metrics.filter_key():
+            return data.overall_sums
+        return data.monthly_cube.monthly_sums(selection, data.df, data.index)
+
+    def map_points(self, selection):
+        return map_data.map_points(self.rows(selection))
+
+    # rows of one page (pages start from 1), only those rows are taken from the frame
+    def page(self, selection, page, page_size=export.PAGE_SIZE):
+        data = self._data
+        start = (page - 1) * page_size
+        return data.df.iloc[np.flatnonzero(data.mask(selection))[start:start + page_size]]
+
+    # some columns of all the houses
+    def columns(self, names):
+        return self._data.df[names]
+
+    # appends new sales: only the new rows are indexed and summed, the monthly sums
+    # change only in the months of the new rows
+    def append(self, rows):
+        data = self._data
+        months = sorted(set(data.df['month'].cat.categories) | set(rows['month'].astype(str)))
+        rows = rows.assign(month=pd.Categorical(rows['month'].astype(str), categories=months, ordered=True))
+        df = pd.concat([data.df.assign(month=data.df['month'].cat.set_categories(months)), rows],
+                       ignore_index=True)
+
+        index = copy.copy(data.index)
+        index.append(rows)
+        monthly_cube = copy.copy(data.monthly_cube)
+        monthly_cube.append(rows)
+        self._data = _PandasData(df, index, monthly_cube,
+                                 metrics.add_sums(data.overall_sums, metrics.monthly_sums(rows)))
+        self.generation += 1
+
+    def add_batches(self, paths):
+        self.append(pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True))
+        self.batches.update(paths)
+
+
+# embedded DuckDB over parquet files: filters and monthly sums are pushed down as SQL,
+# only the aggregates and the requested rows reach Python
+class DuckDBBackend:
+    def __init__(self, files):
+        import duckdb  # optional dependency, only needed for this backend
+
+        self.files = files
+        self.batches = set()  # ingested batch files included in the view (see ingest.py)
+        self.generation = 0
+        self._connection = duckdb.connect()
+        self._create_view()
+
+    @staticmethod
+    def _quote(text):
+        return "'" + text.replace("'", "''") + "'"
+
+    def _create_view(self):
+        files = ', '.join(self._quote(path) for path in [self.files, *sorted(self.batches)])
+        self._connection.execute(
+            f"CREATE OR REPLACE VIEW houses AS SELECT * FROM read_parquet([{files}], union_by_name = true)")
+
+    # the ingested batches are queried together with the data files, nothing to precompute
+    def add_batches(self, paths):
+        self.batches.update(paths)
+        self._create_view()
+        self.generation += 1
+
+    # WHERE clause and parameters of a selection
+    @staticmethod
+    def _where(selection):
+        clauses, parameters = [], []
+        if selection is not None:
+            years, bedrooms, floors, sqft_range = selection
+            for column, values in (('yr_built', years), ('bedrooms', bedrooms), ('floors', floors)):
+                if values:
+                    clauses.append(f"{column} IN ({', '.join('?' * len(values))})")
+                    parameters.extend(values)
+            if sqft_range is not None:
+                clauses.append("sqft_living BETWEEN ? AND ?")
+                parameters.extend(sqft_range)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', parameters
+
+    # a cursor per query: the connection is shared by the sessions (threads)
+    def _query(self, sql, selection=None, parameters_before=(), parameters_after=()):
+        where, parameters = self._where(selection)
+        return self._connection.cursor().execute(
+            sql.format(where=where), [*parameters_before, *parameters, *parameters_after])
+
+    def rows(self, selection):
+        return self._query("SELECT * FROM houses{where}", selection).df()
+
+    def values(self, column, selection=None):
+        if column not in filter_index.CATEGORY_COLUMNS:
+            raise ValueError(f"Not a filter column: {column!r}")
+        result = self._query(f"SELECT DISTINCT {column} FROM houses{{where}} ORDER BY 1", selection)
+        return [row[0] for row in result.fetchall()]
+
+    def sqft_bounds(self, selection):
+        low, high = self._query("SELECT min(sqft_living), max(sqft_living) FROM houses{where}",
+                                selection).fetchone()
+        return None if low is None else (int(low), int(high))
+
+    def summary(self, selection):
+        records, first_date, last_date = self._query(
+            "SELECT count(*), min(date), max(date) FROM houses{where}", selection).fetchone()
+        return {'records': records, 'first_date': first_date, 'last_date': last_date}
+
+    def monthly_sums(self, selection):
+        sums = self._query("SELECT month, count(*) AS homes_sold, sum(price) AS price, "
+                           "sum(sqft_living) AS sqft_living, sum(floors) AS floors, sum(bedrooms) AS bedrooms "
+                           "FROM houses{where} GROUP BY month ORDER BY month", selection).df()
+        return sums.set_index('month')
+
+    def map_points(self, selection, threshold=map_data.MAP_POINTS_THRESHOLD, cell_size=map_data.CELL_SIZE):
+        if self.summary(selection)['records'] <= threshold:
+            return self._query("SELECT round(lat, 5) AS lat, round(lon, 5) AS lon, price AS value "
+                               "FROM houses{where}", selection).df()
+        # same grid cells as map_data.map_points
+        return self._query("SELECT (floor(lat / ?) + 0.5) * ? AS lat, (floor(lon / ?) + 0.5) * ? AS lon, "
+                           "count(*) AS count, median(price) AS value FROM houses{where} GROUP BY 1, 2",
+                           selection, parameters_before=[cell_size] * 4).df()
+
+    def page(self, selection, page, page_size=export.PAGE_SIZE):
+        return self._query("SELECT * FROM houses{where} LIMIT ? OFFSET ?", selection,
+                           parameters_after=(page_size, (page - 1) * page_size)).df()
+
+    def columns(self, names):
+        return self._query(f"SELECT {', '.join(names)} FROM houses{{where}}").df()
@@ -0,0 +1,234 @@
+"""Headless benchmark of the app data pipeline (no Streamlit needed).
+
+Replays a corpus of realistic sidebar selections through the query backend of the app (pandas
+or duckdb) with the same steps as a rerun of main.py, and reports p50 / p95 latency and peak
+traced memory of every stage, on the original data and on synthetically enlarged copies of it:
+
+    $ python benchmark.py --scale 1 10 100 --selections 50 --backend duckdb
+"""
+import argparse
+import json
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+import backends
+import comparables
+import data_loader
+import export
+import figures
+import metrics
+
+
+# the csv file with the rows repeated `scale` times (new ids, so every row stays unique)
+def enlarged_csv(scale, path=data_loader.HOUSE_DATA_PATH, directory=None):
+    if scale == 1:
+        return path
+    house_data = pd.read_csv(path, dtype=str)
+    copies = []
+    for copy in range(scale):
+        copy_data = house_data.copy()
+        copy_data['id'] = (house_data['id'].astype('int64') + copy * 10 ** 10).astype(str)
+        copies.append(copy_data)
+    enlarged_path = os.path.join(directory or tempfile.gettempdir(), f'kc_house_data_x{scale}.csv')
+    pd.concat(copies, ignore_index=True).to_csv(enlarged_path, index=False)
+    return enlarged_path
+
+
+# sidebar selections similar to the ones users make: a few decades of built years,
+# 3-4 bedrooms, sometimes floors and a narrower sqft living range
+def selection_corpus(df, count, seed=0):
+    rng = np.random.default_rng(seed)
+    years = np.sort(df['yr_built'].unique())
+    sqft_low, sqft_high = int(df['sqft_living'].min()), int(df['sqft_living'].max())
+    corpus = [{'years': [], 'bedrooms': [], 'floors': [], 'sqft_range': None}]
+    while len(corpus) < count:
+        first = rng.integers(0, len(years) - 1)
+        selection = {'years': years[first:first + rng.integers(1, 30)].tolist(),
+                     'bedrooms': [] if rng.random() < 0.3 else sorted(rng.choice([2, 3, 4, 5], rng.integers(1, 3),
+                                                                                  replace=False).tolist()),
+                     'floors': [] if rng.random() < 0.6 else [float(rng.choice([1.0, 1.5, 2.0]))],
+                     'sqft_range': None}
+        if rng.random() < 0.5:
+            low = int(rng.integers(sqft_low, 3000))
+            selection['sqft_range'] = (low, int(rng.integers(low, sqft_high + 1)))
+        corpus.append(selection)
+    return corpus
+
+
+# the steps of one rerun of main.py for a selection through the query backend,
+# as (stage name, function) pairs
+def rerun_stages(backend, selection):
+    state = {}
+
+    def sidebar_filters():
+        backend.values('yr_built')
+        backend.values('bedrooms', metrics.filter_key(selection['years']))
+        backend.values('floors', metrics.filter_key(selection['years'], selection['bedrooms']))
+        bounds = backend.sqft_bounds(metrics.filter_key(selection['years'], selection['bedrooms'],
+                                                        selection['floors']))
+        state['key'] = metrics.filter_key(selection['years'], selection['bedrooms'], selection['floors'],
+                                          selection['sqft_range'] or bounds)
+        state['rerun_metrics'] = metrics.RerunMetrics(backend)
+
+    def summary():
+        state['rerun_metrics'].summary(state['key'])
+
+    def monthly_metrics():
+        state['monthly'] = state['rerun_metrics'].monthly(state['key'])
+
+    def statistics_table():
+        state['rerun_metrics'].statistics(state['key'])
+
+    # the two charts shown by default
+    def figure_json():
+        for metric in ['price_per_sqft_living', 'homes_sold']:
+            figures.monthly_figure_json(state['monthly'], metric)
+
+    def map_payload():
+        backend.map_points(state['key'])
+
+    def houses_page():
+        backend.page(state['key'], 1)
+
+    def csv_export():
+        export.csv_bytes(backend.rows(state['key']))
+
+    return [('sidebar filters', sidebar_filters), ('summary', summary), ('monthly metrics', monthly_metrics),
+            ('statistics table', statistics_table), ('figure json', figure_json),
+            ('map payload', map_payload), ('houses page', houses_page), ('csv export', csv_export)]
+
+
+# query backend of the data (see backends.py), the duckdb backend queries a parquet copy of it
+def create_backend(backend, df, directory):
+    if backend == 'pandas':
+        return backends.PandasBackend(df)
+    parquet_path = os.path.join(directory, 'houses.parquet')
+    if not os.path.exists(parquet_path):
+        data_loader.write_parquet(df, parquet_path)
+    return backends.DuckDBBackend(parquet_path)
+
+
+# stages run once per worker (not per rerun)
+STARTUP_STAGES = ['load csv', 'build snapshot', 'load snapshot', 'build backend', 'build comparables']
+
+# batched nearest neighbour queries of the comparables KD-tree against a scan of all the houses
+# (not part of a rerun)
+COMPARABLES_BATCH = 100
+COMPARISON_STAGES = [f'tree x{COMPARABLES_BATCH}', f'brute force x{COMPARABLES_BATCH}']
+
+# stages run only when the user asks for them (the csv button, a new comparables house), not
+# part of the rerun sum
+ON_DEMAND_STAGES = ['csv export', 'comparables']
+
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+# peak memory (bytes) allocated by Python / NumPy while the function runs
+# (Arrow buffers are not traced, see the max RSS of the process for those)
+def traced_peak(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q))
+
+
+def run_scale(scale, selections, seed=0, repeat=3, backend_name=backends.BACKEND):
+    with tempfile.TemporaryDirectory() as directory:
+        csv_path = enlarged_csv(scale, directory=directory)
+        snapshot_path = os.path.join(directory, 'snapshot.feather')
+
+        timings = {stage: [] for stage in STARTUP_STAGES}
+        peaks = {}
+        for _ in range(repeat):
+            timings['load csv'].append(timed(lambda: data_loader.read_app_data(csv_path)))
+            timings['build snapshot'].append(timed(lambda: data_loader.build_snapshot(csv_path, snapshot_path)))
+            timings['load snapshot'].append(timed(lambda: data_loader.read_snapshot(snapshot_path)))
+        peaks['load csv'] = traced_peak(lambda: data_loader.read_app_data(csv_path))
+        peaks['load snapshot'] = traced_peak(lambda: data_loader.read_snapshot(snapshot_path))
+
+        df = data_loader.read_snapshot(snapshot_path)
+        # the parquet file of the duckdb backend is written by the first build
+        create_backend(backend_name, df, directory)
+        for _ in range(repeat):
+            timings['build backend'].append(timed(lambda: create_backend(backend_name, df, directory)))
+        peaks['build backend'] = traced_peak(lambda: create_backend(backend_name, df, directory))
+        backend = create_backend(backend_name, df, directory)
+
+        for selection in selection_corpus(df, selections, seed):
+            for stage, function in rerun_stages(backend, selection):
+                timings.setdefault(stage, []).append(timed(function))
+        # memory of the rerun stages, for the unfiltered selection (the biggest one)
+        for stage, function in rerun_stages(backend, selection_corpus(df, 1)[0]):
+            peaks[stage] = traced_peak(function)
+
+        houses = backend.columns(comparables.COLUMNS)
+        for _ in range(repeat):
+            timings['build comparables'].append(timed(lambda: comparables.ComparablesIndex(houses)))
+        comparables_index = comparables.ComparablesIndex(houses)
+        rng = np.random.default_rng(seed)
+        for _ in range(selections):
+            houses = df.iloc[rng.integers(0, len(df), COMPARABLES_BATCH)]
+            timings.setdefault('comparables', []).append(
+                timed(lambda: comparables_index.comparables(houses.iloc[0])))
+            points = comparables_index.features(houses)
+            timings.setdefault(COMPARISON_STAGES[0], []).append(timed(lambda: comparables_index.query(points)))
+            timings.setdefault(COMPARISON_STAGES[1], []).append(
+                timed(lambda: comparables_index.brute_force(points)))
+
+    return {'scale': scale,
+            'backend': backend_name,
+            'rows': len(df),
+            'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'stages': {stage: {'p50_ms': percentile(values, 50) * 1000,
+                               'p95_ms': percentile(values, 95) * 1000,
+                               'runs': len(values),
+                               'peak_mb': peaks.get(stage, 0) / 1024 / 1024}
+                       for stage, values in timings.items()}}
+
+
+def print_report(result):
+    print('\nscale x{} ({:,} rows, {} backend, max RSS of the process {:.0f} MB)'.format(
+        result['scale'], result['rows'], result['backend'], result['max_rss_mb']))
+    print('{:<20}{:>10}{:>10}{:>8}{:>11}'.format('stage', 'p50 ms', 'p95 ms', 'runs', 'peak MB'))
+    for stage, values in result['stages'].items():
+        print('{:<20}{:>10.1f}{:>10.1f}{:>8}{:>11.1f}'.format(
+            stage, values['p50_ms'], values['p95_ms'], values['runs'], values['peak_mb']))
+    per_rerun = [values for stage, values in result['stages'].items()
+                 if stage not in STARTUP_STAGES + COMPARISON_STAGES + ON_DEMAND_STAGES]
+    print('{:<20}{:>10.1f}{:>10.1f}'.format('rerun (sum)', sum(values['p50_ms'] for values in per_rerun),
+                                            sum(values['p95_ms'] for values in per_rerun)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=int, nargs='+', default=[1, 10], help='row multipliers of the data')
+    parser.add_argument('--selections', type=int, default=50, help='number of sidebar selections replayed')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--backend', choices=['pandas', 'duckdb'], default=backends.BACKEND,
+                        help='query backend the reruns go through (see backends.py)')
+    parser.add_argument('--json', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    for scale in args.scale:
+        results.append(run_scale(scale, args.selections, args.seed, backend_name=args.backend))
+        print_report(results[-1])
+    if args.json:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
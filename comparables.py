@@ -0,0 +1,131 @@
+import heapq
+
+import numpy as np
+
+# number of comparable sales shown
+COMPARABLES = 10
+
+# houses per leaf of the KD-tree
+LEAF_SIZE = 32
+
+# scale of the features of the similarity distance: a distance of 1 is 1 km, 500 sqft living,
+# one grade or one condition level
+KM_PER_DEGREE = 111.2
+FEATURE_SCALES = {'sqft_living': 1 / 500, 'grade': 1.0, 'condition': 1.0}
+
+# columns of the houses needed by the index
+COLUMNS = ['id', 'date', 'price', 'lat', 'lon', *FEATURE_SCALES]
+
+
+# Comparable sales: the k sold houses nearest to a house in a space of the location (km) and the
+# scaled attributes, from a KD-tree (median splits of the widest feature) with the bounding box
+# of every node. A query descends best-first: the nodes are visited in order of the distance to
+# their box and the search stops when no remaining box can hold a nearer house, so the result is
+# exactly the one of a full scan. The houses of a leaf are compared in one vectorized step.
+class ComparablesIndex:
+    def __init__(self, houses, leaf_size=LEAF_SIZE):
+        self.houses = houses[COLUMNS].reset_index(drop=True)
+        # east-west degrees are shorter at the latitude of King County
+        self._lon_scale = KM_PER_DEGREE * np.cos(np.radians(float(self.houses['lat'].mean())))
+        self.points = self.features(self.houses)
+        self._sales = self.houses['id'].value_counts()  # sales of the same house, left out of its comparables
+
+        # nodes: rows [start, stop) of the house order, children (-1 for a leaf) and bounding box
+        order = np.arange(len(self.points))
+        starts, stops, children, lower, upper = [], [], [], [], []
+        stack = [(0, len(order), -1, 0)]
+        while stack:
+            start, stop, parent, side = stack.pop()
+            node = len(starts)
+            if parent >= 0:
+                children[parent][side] = node
+            points = self.points[order[start:stop]]
+            starts.append(start)
+            stops.append(stop)
+            children.append([-1, -1])
+            lower.append(points.min(axis=0))
+            upper.append(points.max(axis=0))
+            if stop - start > leaf_size:
+                axis = np.argmax(upper[node] - lower[node])
+                middle = (stop - start) // 2
+                order[start:stop] = order[start:stop][np.argpartition(points[:, axis], middle)]
+                stack.extend([(start, start + middle, node, 0), (start + middle, stop, node, 1)])
+        self._order = order
+        self._ordered_points = self.points[order]
+        self._starts, self._stops = np.array(starts), np.array(stops)
+        self._children = np.array(children)
+        self._lower, self._upper = np.array(lower), np.array(upper)
+
+    # points of the houses (DataFrame or dict of columns) in the similarity space
+    def features(self, houses):
+        return np.column_stack([np.asarray(houses['lat'], dtype='float64') * KM_PER_DEGREE,
+                                np.asarray(houses['lon'], dtype='float64') * self._lon_scale,
+                                *(np.asarray(houses[column], dtype='float64') * scale
+                                  for column, scale in FEATURE_SCALES.items())])
+
+    # squared distance from a point to the boxes of the nodes
+    def _box_distances(self, point, nodes):
+        gaps = np.maximum(self._lower[nodes] - point, 0) + np.maximum(point - self._upper[nodes], 0)
+        return (gaps ** 2).sum(axis=1)
+
+    # squared distances and positions of the k nearest houses of every query point, nearest first
+    def query(self, points, k=COMPARABLES):
+        points = np.atleast_2d(points)
+        distances = np.empty((len(points), k))
+        houses = np.empty((len(points), k), dtype='int64')
+        for query, point in enumerate(points):
+            distances[query], houses[query] = self._query(point, k)
+        return distances, houses
+
+    def _query(self, point, k):
+        best_distances, best_positions = np.full(k, np.inf), np.full(k, -1)
+        worst = np.inf
+        heap = [(0.0, 0)]
+        while heap:
+            box_distance, node = heapq.heappop(heap)
+            if box_distance >= worst:
+                break
+            children = self._children[node]
+            if children[0] >= 0:
+                for child, distance in zip(children, self._box_distances(point, children)):
+                    if distance < worst:
+                        heapq.heappush(heap, (distance, child))
+                continue
+            # leaf: the distances to its houses at once, merged into the k best
+            start, stop = self._starts[node], self._stops[node]
+            distances = ((self._ordered_points[start:stop] - point) ** 2).sum(axis=1)
+            distances = np.concatenate([best_distances, distances])
+            positions = np.concatenate([best_positions, np.arange(start, stop)])
+            nearest = np.argpartition(distances, k - 1)[:k]
+            best_distances, best_positions = distances[nearest], positions[nearest]
+            worst = best_distances.max()
+        nearest = np.argsort(best_distances, kind='stable')
+        return best_distances[nearest], self._order[best_positions[nearest]]
+
+    # same result as query() by computing the distances to all the houses (for the benchmark)
+    def brute_force(self, points, k=COMPARABLES, chunk_size=2 ** 22):
+        points = np.atleast_2d(points)
+        best_distances, best_houses = [], []
+        chunk = max(1, chunk_size // len(self.points))
+        for start in range(0, len(points), chunk):
+            distances = ((self.points - points[start:start + chunk, np.newaxis]) ** 2).sum(axis=2)
+            nearest = np.argpartition(distances, k - 1, axis=1)[:, :k]
+            best_distances.append(np.take_along_axis(distances, nearest, axis=1))
+            best_houses.append(nearest)
+        return self._sorted(np.concatenate(best_distances), np.concatenate(best_houses))
+
+    @staticmethod
+    def _sorted(distances, houses):
+        order = np.argsort(distances, axis=1, kind='stable')
+        return np.take_along_axis(distances, order, axis=1), np.take_along_axis(houses, order, axis=1)
+
+    # the k comparable sales of a house (a row with the COLUMNS, its id left out of the comparables)
+    # and the price estimate: median price per sqft living of the comparables times its sqft living
+    def comparables(self, house, k=COMPARABLES):
+        other_sales = self._sales.get(house.get('id'), 0)
+        point = self.features({column: [house[column]] for column in ['lat', 'lon', *FEATURE_SCALES]})
+        distances, houses = self.query(point, k + other_sales)
+        comparable = self.houses.iloc[houses[0]].assign(distance=np.sqrt(distances[0]))
+        comparable = comparable[comparable['id'] != house.get('id')].head(k)
+        price_per_sqft = (comparable['price'] / comparable['sqft_living']).median()
+        return comparable.reset_index(drop=True), price_per_sqft * house['sqft_living']
@@ -0,0 +1,150 @@
+import os
+import sys
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+# CSV FILE
+HOUSE_DATA_PATH = 'kc_house_data.csv'
+
+# columnar snapshot of the app data (Arrow IPC / Feather, uncompressed so it can be memory mapped)
+SNAPSHOT_PATH = 'kc_house_data.feather'
+
+# parquet copy of the app data for the embedded query engine (see backends.py)
+PARQUET_PATH = 'kc_house_data.parquet'
+
+# compact column types - the raw values fit comfortably in these ranges
+HOUSE_DTYPES = {
+    'id': 'int64',
+    'price': 'int32',
+    'bedrooms': 'int8',
+    'bathrooms': 'float32',
+    'sqft_living': 'int32',
+    'sqft_lot': 'int32',
+    'floors': 'float32',  # half floors (1.5, 2.5) exist, so not an int
+    'waterfront': 'int8',
+    'view': 'int8',
+    'condition': 'int8',
+    'grade': 'int8',
+    'sqft_above': 'int32',
+    'sqft_basement': 'int32',
+    'yr_built': 'int16',
+    'yr_renovated': 'int16',
+    'zipcode': 'category',
+    'lat': 'float32',
+    'long': 'float32',
+    'sqft_living15': 'int32',
+    'sqft_lot15': 'int32',
+}
+
+# dates are stored as "20141013T000000"
+DATE_FORMAT = '%Y%m%dT%H%M%S'
+
+# columns not used by the app
+UNUSED_COLUMNS = ['bathrooms', 'sqft_lot', 'view', 'sqft_above',
+                  'sqft_basement', 'yr_renovated', 'zipcode', 'sqft_living15', 'sqft_lot15']
+
+
+# reads the csv file with compact dtypes and a fixed date format
+def read_house_data(path=HOUSE_DATA_PATH):
+    house_data = pd.read_csv(path, dtype={**HOUSE_DTYPES, 'date': str})
+    house_data['date'] = pd.to_datetime(house_data['date'], format=DATE_FORMAT)
+    return house_data
+
+
+# the data used by the app: unused columns removed, "long" renamed to "lon" for st.map
+# and the sale month precomputed
+def prepare_app_data(house_data):
+    app_data = house_data.drop(columns=UNUSED_COLUMNS).rename(columns={'long': 'lon'})
+    # ordered, so groupby(observed=True) keeps the months sorted
+    months = app_data['date'].dt.strftime('%Y-%m')
+    app_data['month'] = pd.Categorical(months, categories=sorted(months.unique()), ordered=True)
+    return app_data
+
+
+def read_app_data(path=HOUSE_DATA_PATH):
+    return prepare_app_data(read_house_data(path))
+
+
+# SNAPSHOT
+def snapshot_is_fresh(path=HOUSE_DATA_PATH, snapshot_path=SNAPSHOT_PATH):
+    return (os.path.exists(snapshot_path)
+            and os.path.getmtime(snapshot_path) >= os.path.getmtime(path))
+
+
+def write_snapshot(app_data, snapshot_path=SNAPSHOT_PATH):
+    # write to a temporary file first so other workers never read a half written snapshot
+    tmp_path = snapshot_path + '.tmp'
+    feather.write_feather(app_data, tmp_path, compression='uncompressed')
+    os.replace(tmp_path, snapshot_path)
+
+
+def read_snapshot(snapshot_path=SNAPSHOT_PATH):
+    # memory mapped read, split_blocks avoids consolidating the columns into new blocks
+    table = feather.read_table(snapshot_path, memory_map=True)
+    return table.to_pandas(split_blocks=True)
+
+
+def build_snapshot(path=HOUSE_DATA_PATH, snapshot_path=SNAPSHOT_PATH):
+    app_data = read_app_data(path)
+    write_snapshot(app_data, snapshot_path)
+    return app_data
+
+
+# prefers the snapshot, (re)builds it when it is missing or older than the csv file
+def load_app_data(path=HOUSE_DATA_PATH, snapshot_path=SNAPSHOT_PATH):
+    if snapshot_is_fresh(path, snapshot_path):
+        return read_snapshot(snapshot_path)
+    try:
+        return build_snapshot(path, snapshot_path)
+    except OSError:
+        # read-only file system - keep working from the csv file
+        return read_app_data(path)
+
+
+# PARQUET
+def write_parquet(app_data, parquet_path=PARQUET_PATH):
+    tmp_path = parquet_path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(app_data, preserve_index=False), tmp_path)
+    os.replace(tmp_path, parquet_path)
+
+
+# (re)builds the parquet file when it is missing or older than the csv file
+def ensure_parquet(path=HOUSE_DATA_PATH, parquet_path=PARQUET_PATH):
+    if not snapshot_is_fresh(path, parquet_path):
+        write_parquet(load_app_data(path), parquet_path)
+    return parquet_path
+
+
+# STARTUP TIMING REPORT
+def timing_report(path=HOUSE_DATA_PATH, snapshot_path=SNAPSHOT_PATH):
+    start = time.perf_counter()
+    read_app_data(path)
+    csv_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    read_snapshot(snapshot_path)
+    snapshot_seconds = time.perf_counter() - start
+
+    return {'csv_seconds': csv_seconds,
+            'snapshot_seconds': snapshot_seconds,
+            'speedup': csv_seconds / snapshot_seconds}
+
+
+# conversion step (run before the app starts): python data_loader.py [csv path]
+if __name__ == '__main__':
+    csv_path = sys.argv[1] if len(sys.argv) > 1 else HOUSE_DATA_PATH
+    if not snapshot_is_fresh(csv_path):
+        try:
+            build_snapshot(csv_path)
+            print('Snapshot written to', SNAPSHOT_PATH)
+        except OSError as error:
+            # read-only or full file system - the app keeps working from the csv file
+            print('Snapshot not written ({}), the app reads the csv file'.format(error))
+            sys.exit(0)
+    report = timing_report(csv_path)
+    print('Load time - csv: {:.1f} ms, snapshot: {:.1f} ms ({:.1f}x faster)'.format(
+        report['csv_seconds'] * 1000, report['snapshot_seconds'] * 1000, report['speedup']))
@@ -0,0 +1,31 @@
+import gzip
+import io
+
+# rows of the filtered houses list shown per page
+PAGE_SIZE = 100
+
+# rows serialized at a time when writing the csv file
+CSV_CHUNK_ROWS = 5000
+
+
+# number of pages of a list of `rows` rows (at least one)
+def page_count(rows, page_size=PAGE_SIZE):
+    return max(1, -(-rows // page_size))
+
+
+# the csv file in chunks of rows, the header only with the first chunk
+def iter_csv_chunks(df, chunk_rows=CSV_CHUNK_ROWS):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        chunk = df.iloc[start:start + chunk_rows]
+        yield chunk.to_csv(index=False, header=start == 0).encode('utf-8')
+
+
+# csv file of the data, optionally gzip compressed
+def csv_bytes(df, compress=False, chunk_rows=CSV_CHUNK_ROWS):
+    buffer = io.BytesIO()
+    out = gzip.GzipFile(fileobj=buffer, mode='wb') if compress else buffer
+    for chunk in iter_csv_chunks(df, chunk_rows):
+        out.write(chunk)
+    if compress:
+        out.close()
+    return buffer.getvalue()
@@ -0,0 +1,39 @@
+import plotly.graph_objects as go
+import plotly.io as pio
+
+# shared look of the monthly charts, applied on top of the default plotly template
+pio.templates['king_county'] = go.layout.Template(layout={
+    'height': 400,
+    'showlegend': False,
+    'xaxis': {'title': {'text': 'Months'}, 'tickangle': 45, 'fixedrange': True,
+              'dtick': 'M1', 'tickformat': '%b %Y'},
+})
+TEMPLATE = 'plotly+king_county'
+
+# metric of the monthly metrics frame -> chart type and y axis label
+MONTHLY_FIGURES = {
+    'price_per_sqft_living': ('line', 'Average price sqft/month (USD)'),
+    'average_price_per_deal': ('line', 'Average price per deal/month (USD)'),
+    'price_per_bedroom': ('line', 'Average price per bedroom/month (USD)'),
+    'price_per_floor': ('line', 'Average price per floor/month (USD)'),
+    'homes_sold': ('bar', 'Sold homes'),
+    'total_price': ('bar', 'Total price'),
+}
+
+
+# chart of one metric of the monthly metrics frame
+def monthly_figure(monthly, metric, title=None):
+    kind, label = MONTHLY_FIGURES[metric]
+    months = monthly.index.tolist()
+    values = monthly[metric].tolist()
+    if kind == 'line':
+        trace = go.Scatter(x=months, y=values, mode='lines', name=label)
+    else:
+        trace = go.Bar(x=months, y=values, name=label)
+    return go.Figure(trace, layout={'template': TEMPLATE, 'title': title,
+                                    'yaxis': {'title': {'text': label}}})
+
+
+# the chart serialized to plotly json (to be cached and rendered later)
+def monthly_figure_json(monthly, metric, title=None):
+    return monthly_figure(monthly, metric, title).to_json()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+# sidebar filters with a list of values to choose from
+CATEGORY_COLUMNS = ['yr_built', 'bedrooms', 'floors']
+
+
+# smallest integer type for the codes of `size` values
+def _code_dtype(size):
+    return np.int16 if size <= np.iinfo(np.int16).max else np.int32
+
+
+# Precomputed index of the sidebar filters. The values of the category columns are coded
+# (2 bytes per row and column), sqft living is kept sorted for range lookups. Filtering looks up
+# the codes in a table of the selected values and combines the results into one row mask,
+# without intermediate DataFrames.
+class FilterIndex:
+    def __init__(self, df):
+        self.size = len(df)
+        self._values = {}
+        self._codes = {}
+        self._positions = {}
+        for column in CATEGORY_COLUMNS:
+            codes, values = pd.factorize(df[column], sort=True)
+            self._values[column] = np.asarray(values)
+            self._codes[column] = codes.astype(_code_dtype(len(values)))
+            self._positions[column] = {value: code for code, value in enumerate(values.tolist())}
+
+        sqft_living = df['sqft_living'].to_numpy()
+        self._sqft_order = np.argsort(sqft_living, kind='stable')
+        self._sqft_sorted = sqft_living[self._sqft_order]
+
+    def all_rows(self):
+        return np.ones(self.size, dtype=bool)
+
+    # distinct values of the column (ascending) in the rows of the mask
+    # (values added by append() come after the initial ones, hence the sort)
+    def values(self, column, mask=None):
+        values = self._values[column]
+        if mask is not None:
+            present = np.bincount(self._codes[column][mask], minlength=len(values)) > 0
+            values = values[present]
+        return sorted(values.tolist())
+
+    # rows with one of the selected values, all the rows when nothing is selected
+    def isin(self, column, selected):
+        if len(selected) == 0:
+            return self.all_rows()
+        lookup = np.zeros(len(self._values[column]), dtype=bool)
+        lookup[[self._positions[column][value] for value in selected if value in self._positions[column]]] = True
+        return lookup[self._codes[column]]
+
+    # smallest and biggest sqft living in the rows of the mask
+    def sqft_bounds(self, mask):
+        sorted_mask = mask[self._sqft_order]
+        if not sorted_mask.any():
+            return None
+        first = sorted_mask.argmax()
+        last = len(sorted_mask) - 1 - sorted_mask[::-1].argmax()
+        return int(self._sqft_sorted[first]), int(self._sqft_sorted[last])
+
+    # rows with sqft living in [low, high]
+    def sqft_between(self, low, high):
+        mask = np.zeros(self.size, dtype=bool)
+        mask[self.sqft_rows(low, high)] = True
+        return mask
+
+    # positions of the rows with sqft living in [low, high]
+    def sqft_rows(self, low, high):
+        start = np.searchsorted(self._sqft_sorted, low, side='left')
+        stop = np.searchsorted(self._sqft_sorted, high, side='right')
+        return self._sqft_order[start:stop]
+
+    # rows of a whole sidebar selection (sqft_range None: no sqft living filter)
+    def select(self, years=(), bedrooms=(), floors=(), sqft_range=None):
+        mask = self.isin('yr_built', years) & self.isin('bedrooms', bedrooms) & self.isin('floors', floors)
+        if sqft_range is not None:
+            mask &= self.sqft_between(*sqft_range)
+        return mask
+
+    # adds the rows at the end of the index: only the new rows are coded, new values get the next
+    # codes. The attributes are replaced (not modified), so a shallow copy of the index can be
+    # appended to while the original is still being read.
+    def append(self, rows):
+        offset, added = self.size, len(rows)
+        new_rows = np.arange(offset, offset + added)
+        values, codes, positions = {}, {}, {}
+        for column in CATEGORY_COLUMNS:
+            positions[column] = dict(self._positions[column])
+            new_values = [value for value in pd.unique(rows[column]).tolist() if value not in positions[column]]
+            for value in new_values:
+                positions[column][value] = len(positions[column])
+            values[column] = np.append(self._values[column], new_values).astype(self._values[column].dtype)
+
+            row_codes = pd.Index(values[column]).get_indexer(rows[column])
+            codes[column] = np.concatenate([self._codes[column], row_codes]).astype(
+                _code_dtype(len(values[column])), copy=False)
+        self._values, self._codes, self._positions = values, codes, positions
+
+        # merge the new sqft living values into the sorted array
+        sqft_living = rows['sqft_living'].to_numpy()
+        new_order = np.argsort(sqft_living, kind='stable')
+        insert_at = np.searchsorted(self._sqft_sorted, sqft_living[new_order], side='right')
+        self._sqft_sorted = np.insert(self._sqft_sorted, insert_at, sqft_living[new_order])
+        self._sqft_order = np.insert(self._sqft_order, insert_at, new_rows[new_order])
+        self.size = offset + added
@@ -0,0 +1,150 @@
+"""Incremental ingestion of new sales.
+
+New CSV batches (same columns as kc_house_data.csv) are dropped into the incoming directory and
+merged with:
+
+    $ python ingest.py
+
+Every batch is validated against the schema of the data and deduplicated by (id, date) against the
+stored sales and itself. The new rows are written as a parquet file to the ingested directory and
+the batch is moved to incoming/processed (or incoming/rejected when it is not valid). Running app
+workers pick up the new files on their next rerun and append them to the data they already have
+in memory, without reloading it.
+"""
+import glob
+import os
+import shutil
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import backends
+import data_loader
+
+# new csv batches
+INCOMING_DIR = 'incoming'
+
+# validated and deduplicated batches (parquet), applied by the app in name order
+INGESTED_DIR = 'ingested'
+
+# smallest valid values of a batch (checked after the range of the compact dtypes)
+MIN_VALUES = {'price': 1, 'sqft_living': 1, 'bedrooms': 0, 'floors': 1, 'yr_built': 1800}
+
+# only one thread of a worker applies the new batches
+_apply_lock = threading.Lock()
+
+
+# ingested batch files, oldest first
+def batch_files(directory=INGESTED_DIR):
+    return sorted(glob.glob(os.path.join(directory, '*.parquet')))
+
+
+# reads and validates a csv batch, raises ValueError when it does not match the schema
+def read_batch(path):
+    header = pd.read_csv(path, nrows=0).columns.tolist()
+    expected = ['id', 'date', *data_loader.HOUSE_DTYPES]
+    missing = sorted(set(expected) - set(header))
+    unexpected = sorted(set(header) - set(expected))
+    if missing or unexpected:
+        raise ValueError(f"{path}: missing columns {missing}, unexpected columns {unexpected}")
+    # read with wide dtypes first: read_csv wraps the values that do not fit a compact integer dtype
+    wide_dtypes = {column: dtype if dtype == 'category' else np.dtype(dtype).kind + '8'
+                   for column, dtype in data_loader.HOUSE_DTYPES.items()}
+    try:
+        # integer columns reject empty values, the date format is fixed
+        house_data = pd.read_csv(path, dtype={**wide_dtypes, 'date': str})
+        house_data['date'] = pd.to_datetime(house_data['date'], format=data_loader.DATE_FORMAT)
+    except (ValueError, TypeError, OverflowError) as error:
+        raise ValueError(f"{path}: {error}") from error
+
+    for column, dtype in data_loader.HOUSE_DTYPES.items():
+        if dtype == 'category':
+            continue
+        values = house_data[column]
+        limits = np.iinfo(dtype) if np.dtype(dtype).kind == 'i' else np.finfo(dtype)
+        valid = values.between(max(limits.min, MIN_VALUES.get(column, limits.min)), limits.max)
+        if not valid.all():
+            raise ValueError(f"{path}: invalid {column} values {values[~valid].unique()[:5].tolist()}")
+    return data_loader.prepare_app_data(house_data.astype(data_loader.HOUSE_DTYPES))
+
+
+# (id, date) pairs of the stored sales: the data of the query backend (the csv data or the parquet
+# files of KING_COUNTY_PARQUET) and the batches ingested so far
+def stored_keys():
+    keys = [backends.data_keys()]
+    keys.extend(pq.read_table(path, columns=['id', 'date']).to_pandas() for path in batch_files())
+    return pd.MultiIndex.from_frame(pd.concat(keys, ignore_index=True))
+
+
+# rows of the batch that are not stored yet (and not repeated in the batch)
+def new_rows(batch, keys):
+    batch = batch.drop_duplicates(['id', 'date'])
+    return batch[~pd.MultiIndex.from_frame(batch[['id', 'date']]).isin(keys)].reset_index(drop=True)
+
+
+def write_batch(rows, name):
+    os.makedirs(INGESTED_DIR, exist_ok=True)
+    # the timestamp keeps the files in ingestion order
+    path = os.path.join(INGESTED_DIR, '{}-{}.parquet'.format(time.strftime('%Y%m%d%H%M%S'), name))
+    tmp_path = path + '.tmp'
+    pq.write_table(pa.Table.from_pandas(rows, preserve_index=False), tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _move(path, directory):
+    os.makedirs(directory, exist_ok=True)
+    shutil.move(path, os.path.join(directory, os.path.basename(path)))
+
+
+# ingests all the csv batches of the incoming directory, returns {batch: new rows or error}
+def ingest_incoming(directory=INCOMING_DIR):
+    report = {}
+    keys = None
+    for path in sorted(glob.glob(os.path.join(directory, '*.csv'))):
+        try:
+            batch = read_batch(path)
+        except ValueError as error:
+            report[path] = str(error)
+            _move(path, os.path.join(directory, 'rejected'))
+            continue
+        keys = stored_keys() if keys is None else keys
+        rows = new_rows(batch, keys)
+        if len(rows) > 0:
+            write_batch(rows, os.path.splitext(os.path.basename(path))[0])
+            keys = keys.append(pd.MultiIndex.from_frame(rows[['id', 'date']]))
+        report[path] = len(rows)
+        _move(path, os.path.join(directory, 'processed'))
+    return report
+
+
+# appends the ingested batches the backend has not seen yet, returns True when there were any
+def apply_new_batches(backend):
+    if not set(batch_files()) - backend.batches:
+        return False
+    with _apply_lock:
+        new_files = [path for path in batch_files() if path not in backend.batches]
+        if new_files:
+            backend.add_batches(new_files)
+        return bool(new_files)
+
+
+# the backend of the app with the ingested batches appended, as the app loads it
+def load_backend(backend=backends.BACKEND):
+    loaded = backends.create_backend(backend)
+    apply_new_batches(loaded)
+    return loaded
+
+
+if __name__ == '__main__':
+    incoming = sys.argv[1] if len(sys.argv) > 1 else INCOMING_DIR
+    for batch_path, result in ingest_incoming(incoming).items():
+        if isinstance(result, str):
+            print('Rejected', result)
+        else:
+            print('{}: {} new sales'.format(batch_path, result))
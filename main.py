@@ -1,74 +1,158 @@
+import json
+import os
+
 import streamlit as st
-import pandas as pd
-import plotly.express as px
+
+import backends
+import comparables
+import export
+import figures
+import ingest
+import map_data
+import metrics
+import profiling
+import result_cache
+import warmup
 
 # PAGE CONFIGURATION
 st.set_page_config(
     page_title="King County - pricing"  # , layout="wide"
 )
 
-# CSV FILE
-houseData = pd.read_csv('kc_house_data.csv', parse_dates=["date"])
+query_params = st.experimental_get_query_params()
+
+# PROFILING MODE: KING_COUNTY_PROFILE=1 environment variable, or ?profile=<token> in the url when
+# KING_COUNTY_PROFILE_TOKEN is set (so visitors of the public app cannot switch it on),
+# times the stages of the rerun and the payload sent per element
+profile_token = os.environ.get('KING_COUNTY_PROFILE_TOKEN')
+profile = profiling.RerunProfile(enabled=os.environ.get('KING_COUNTY_PROFILE') == '1'
+                                 or (bool(profile_token) and query_params.get('profile') == [profile_token]))
+
+
+# QUERY BACKEND (KING_COUNTY_BACKEND: pandas or duckdb): the data is loaded / opened once per process
+# and shared by all sessions, the data version (file modification time) is part of the cache key
+# so new data is picked up; only the latest version (and its caches below) is kept in memory
+@st.cache_resource(max_entries=1)
+def load_backend(backend, data_version):
+    return ingest.load_backend(backend)
+
+
+data_version = backends.data_version()
+backend = load_backend(backends.BACKEND, data_version)
+profile.lap('load data')
+
+
+# WARM CACHE: results precomputed before the start (python warmup.py), read on the first request
+# of the process, None when there is none for this data
+@st.cache_resource(max_entries=1)
+def load_warm_cache(_backend, data_version):
+    return warmup.read_warm_cache(_backend, data_version)
+
 
-df = houseData.drop(
-    columns=['bathrooms', 'sqft_lot', 'view', 'sqft_above',
-             'sqft_basement', 'yr_renovated', 'zipcode', 'sqft_living15', 'sqft_lot15'])
+warm_cache = load_warm_cache(backend, data_version)
 
-tab1, tab2 = st.tabs([""
-                      " **FILTERED DATA** "
-                      "", ""
-                          " **OVERALL DATA** "
-                          ""])
 
+# FILTERED RESULTS CACHE: summary, monthly metrics and map payload of the recent filter selections,
+# shared by all sessions (a new data version starts with an empty cache, or the warm cache)
+@st.cache_resource(max_entries=1)
+def load_result_cache(data_version):
+    cache = result_cache.LRUResultCache()
+    if warm_cache is not None:
+        for key, result in warm_cache['filtered'].items():
+            cache.put((warm_cache['generation'], key), result)
+    return cache
 
-@st.cache_data
-def convert_df(df):
-    return df.to_csv(index=False).encode('utf-8')
 
+filtered_results = load_result_cache(data_version)
 
-# price per sqft living function
-def divide_price_per_sqft_living(df_sub):
-    if df_sub['sqft_living'].sum() > 0:
-        return float(df_sub['price'].sum()) / float(df_sub['sqft_living'].sum())
+# DEBUG MODE: KING_COUNTY_DEBUG=1 environment variable or ?debug=1 in the url
+debug = (os.environ.get('KING_COUNTY_DEBUG') == '1'
+         or query_params.get('debug') == ['1'])
 
+# metrics computed in this rerun
+rerun_metrics = metrics.RerunMetrics(backend)
 
-# price per floor function
-def divide_price_per_floor(df_sub):
-    if df_sub['sqft_living'].sum() > 0:
-        return float(df_sub['price'].sum()) / float(df_sub['floors'].sum())
+tab1, tab2, tab3 = st.tabs([""
+                            " **FILTERED DATA** "
+                            "", ""
+                                " **OVERALL DATA** "
+                                "", ""
+                                    " **COMPARABLE SALES** "
+                                    ""])
 
 
-# price per bedroom function
-def divide_price_per_bedroom(df_sub):
-    if df_sub['sqft_living'].sum() > 0:
-        return float(df_sub['price'].sum()) / float(df_sub['bedrooms'].sum())
+# CHARTS: metric of the monthly metrics frame shown by each chart
+PRICE_CHARTS = {"Average price per sqft living": 'price_per_sqft_living',
+                "Average price per deal": 'average_price_per_deal',
+                "Average price per bedroom": 'price_per_bedroom',
+                "Average price per floor": 'price_per_floor'}
+SOLD_CHARTS = {"Houses sold": 'homes_sold',
+               "Total price of sold houses": 'total_price'}
+OVERALL_PRICE_CHARTS = {"Average price per sqft per month": 'price_per_sqft_living',
+                        "Average price per deal per month": 'average_price_per_deal',
+                        "Average price per bedroom per month": 'price_per_bedroom',
+                        "Average price per floor per month": 'price_per_floor'}
 
 
-# average price per deal function
-def average_price_per_deal(df_sub):
-    if df_sub['sqft_living'].sum() > 0:
-        return round(float(df_sub['price'].sum()) / float(df_sub['id'].count()))
+# FIGURES CACHE: plotly json of the charts by (metric, filter key), shared by all sessions
+@st.cache_resource(max_entries=1)
+def load_figure_cache(data_version):
+    cache = result_cache.LRUResultCache()
+    if warm_cache is not None:
+        for (metric, key), figure in warm_cache['figures'].items():
+            cache.put((warm_cache['generation'], metric, key), figure)
+    return cache
 
 
-def total_homes_sold(df_sub):
-    if df_sub['id'].count() > 0:
-        return float(df_sub['id'].count())
+figure_cache = load_figure_cache(data_version)
 
+# NEW SALES: batches ingested since the data was loaded (python ingest.py) are appended to it,
+# the generation of the data is part of the cache keys so results of the previous data are not reused
+if ingest.apply_new_batches(backend):
+    filtered_results.clear()
+    figure_cache.clear()
+generation = backend.generation
+profile.lap('new sales')
 
-def total_price_sold(df_sub):
-    if df_sub['price'].sum() > 0:
-        return float(df_sub['price'].sum())
 
+# Streamlit release whose chart message plotly_json_chart writes directly; with any other
+# version the charts go through the public st.plotly_chart
+PLOTLY_PROTO_VERSION = '1.21.0'
 
-# homes sold, total price, avg price per sqft, average price function
-def average_max_min_sqft_living(df_sub):
-    d = {'homes sold': df_sub['id'].count(),
-         'total price': '${:,.2f}'.format(df_sub['price'].sum()),
-         'avg price per sqft': '${:,.2f}'.format(divide_price_per_sqft_living(df_sub)),
-         'average price': '${:,.2f}'.format(average_price_per_deal(df_sub))
-         }
-    return pd.Series(d, index=['homes sold', 'total price', 'avg price per sqft',
-                               'average price'])  # , #'max price', 'min price'])
+
+# renders a cached plotly json. st.plotly_chart rebuilds and validates a go.Figure from it on every
+# call (~15 ms per chart); on the pinned release the json, already a valid figure, is sent as it is
+def plotly_json_chart(spec):
+    if st.__version__ != PLOTLY_PROTO_VERSION:
+        st.plotly_chart(json.loads(spec), use_container_width=True)
+        return
+    from streamlit.proto.PlotlyChart_pb2 import PlotlyChart as PlotlyChartProto
+
+    proto = PlotlyChartProto()
+    proto.use_container_width = True
+    proto.figure.spec = spec
+    proto.figure.config = json.dumps({'showLink': False, 'linkText': False})  # same as st.plotly_chart
+    proto.theme = 'streamlit'
+    st._main._enqueue('plotly_chart', proto)
+
+
+# renders the chart of one monthly metric, built only when it is not in the figures cache
+def monthly_chart(metric, key, monthly):
+    cached = figure_cache.get((generation, metric, key))
+    if cached is None:
+        cached = {'json': figures.monthly_figure_json(monthly, metric)}
+        figure_cache.put((generation, metric, key), cached)
+    plotly_json_chart(cached['json'])
+    profile.payload(f'chart {metric}', lambda: len(cached['json']))
+
+
+# OVERALL TAB: depends only on the data, so the aggregates, headline totals and the figures (as json)
+# are computed once per data version (and generation of appended sales) and shared by all sessions
+@st.cache_resource(max_entries=2)
+def overall_view(_backend, data_version, generation):
+    if warm_cache is not None and warm_cache['generation'] == generation:
+        return warm_cache['overall']
+    return metrics.overall_view(_backend)
 
 
 # SIDEBAR
@@ -76,51 +160,53 @@ def average_max_min_sqft_living(df_sub):
 st.sidebar.header('Filter the parameters')
 
 # BUILT YEAR :
-subset_year_data = df
 year_input = st.sidebar.multiselect(
     'Choose the year of built',
-    df.sort_values('yr_built', ascending=False)['yr_built'].unique(),
+    backend.values('yr_built')[::-1],
     help='Select the year of build (possible multiple selection)')
 
-if len(year_input) > 0:
-    subset_year_data = df[df['yr_built'].isin(year_input)]
-
 # NUMBER OF BEDROOMS:
-subset_bedrooms_data = subset_year_data
 bedrooms_input = st.sidebar.multiselect(
     'Number of bedrooms',
-    subset_year_data.groupby('bedrooms').count().reset_index()['bedrooms'].tolist(),
+    backend.values('bedrooms', metrics.filter_key(year_input)),
     help='Select the number of bedrooms (possible multiple selection)')
 
-if len(bedrooms_input) > 0:
-    subset_bedrooms_data = subset_year_data[subset_year_data['bedrooms'].isin(bedrooms_input)]
-
 # NUMBER OF FLOORS:
-subset_floors_data = subset_bedrooms_data
 floors_input = st.sidebar.multiselect(
     'Number of floors',
-    subset_bedrooms_data.groupby('floors').count().reset_index()['floors'].tolist(),
+    backend.values('floors', metrics.filter_key(year_input, bedrooms_input)),
     help='Select the number of floors (possible multiple selection)')
 
-if len(floors_input) > 0:
-    subset_floors_data = subset_bedrooms_data[subset_bedrooms_data['floors'].isin(floors_input)]
-
 # SQFT SLIDER:
-sqftSlider = subset_floors_data['sqft_living']
-if int(sqftSlider.min()) == int(sqftSlider.max()):
-    sqft_living_selected = sqftSlider.min()
-    mask_sqft = subset_floors_data['sqft_living'].eq(sqft_living_selected)
+sqft_min, sqft_max = backend.sqft_bounds(metrics.filter_key(year_input, bedrooms_input, floors_input))
+if sqft_min == sqft_max:
+    sqft_living_selected = sqft_min
+    sqft_range = (sqft_min, sqft_max)
     st.write("There is only size of house (*sqft living*) in this criteria:", sqft_living_selected)
 else:
     sqft_living_selected = st.sidebar.slider(label="Select the range of sqft living :",
-                                             min_value=int(sqftSlider.min()),
-                                             max_value=int(sqftSlider.max()),
-                                             value=(int(sqftSlider.min()), int(sqftSlider.max())),
+                                             min_value=sqft_min,
+                                             max_value=sqft_max,
+                                             value=(sqft_min, sqft_max),
                                              help='Choose the range of square feet of living ')
-    mask_sqft = subset_floors_data['sqft_living'].between(*sqft_living_selected)
-
-# FINAL FILTERED DATAFRAME:
-df_filtered = subset_floors_data[mask_sqft]
+    sqft_range = sqft_living_selected
+profile.lap('sidebar filters')
+
+# FINAL FILTERED DATA: the backend returns only the aggregates, common selections
+# are served from the shared results cache
+filtered_key = metrics.filter_key(year_input, bedrooms_input, floors_input, sqft_range)
+filtered_result = filtered_results.get((generation, filtered_key))
+if filtered_result is None:
+    filtered_result = {'summary': rerun_metrics.summary(filtered_key),
+                       'monthly': rerun_metrics.monthly(filtered_key),
+                       'map': backend.map_points(filtered_key)}
+    filtered_results.put((generation, filtered_key), filtered_result)
+    # the selections most often missing from the cache are warmed up on the next start
+    warmup.log_selection(filtered_key)
+else:
+    rerun_metrics.seed(filtered_key, 'summary', filtered_result['summary'])
+    rerun_metrics.seed(filtered_key, 'monthly', filtered_result['monthly'])
+profile.lap('filtered result')
 
 st.sidebar.write("###### To remove the filters : clean the filters of the year of built")
 
@@ -135,188 +221,86 @@ with tab1:
              ", Sqft living :",
              sqft_living_selected)
 
-    if df_filtered.id.count() == 0:
+    summary_filtered = rerun_metrics.summary(filtered_key)
+    if summary_filtered['records'] == 0:
         st.error("Zero records found. Please select some other criteria")
 
     else:
-        if df_filtered.id.count() == 1:
-            st.write("Found: ", df_filtered.id.count(), " record between ", df_filtered.date.min(),
-                     " and ", df_filtered.date.max())
+        if summary_filtered['records'] == 1:
+            st.write("Found: ", summary_filtered['records'], " record between ", summary_filtered['first_date'],
+                     " and ", summary_filtered['last_date'])
         else:
-            st.write("Found: ", df_filtered.id.count(), " records between ", df_filtered.date.min(),
-                     " and ", df_filtered.date.max())
-
-        # DATAFRAMES FOR CHARTS : APPLIED FUNCTIONS
-        df_filtered['month'] = pd.to_datetime(df_filtered['date']).dt.strftime('%Y-%m')
-
-        df_average_price_sqft = df_filtered.groupby('month').apply(
-            divide_price_per_sqft_living)
-
-        df_average_price_floor = df_filtered.groupby('month').apply(
-            divide_price_per_floor)
-
-        df_average_price_deal = df_filtered.groupby('month').apply(
-            average_price_per_deal)
-
-        if df_average_price_sqft.size > 0:
-            tabA, tabB, tabC, tabD = st.tabs(
-                ["Average price per sqft living", "Average price per deal", "Average price per bedroom",
-                 "Average price per floor"])
-            # tabA Average price per sqft living
-            with tabA:
-                st.write("""
-                            ##### Average price per sqft living:
-                            """)
-
-                df_average_price_sqft_filtered = df_filtered.groupby(['month']).apply(
-                    divide_price_per_sqft_living)
-
-                average_price_sqft_filtered = px.line(df_average_price_sqft_filtered, height=400,
-                                                      labels={
-                                                          "value": "Average price sqft/month (USD)",
-                                                          "month": "Months"}
-                                                      # ,  title='Average price per square feet per month'
-                                                      )
-                average_price_sqft_filtered.update_xaxes(tickangle=45, fixedrange=True)
-                average_price_sqft_filtered.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                average_price_sqft_filtered.update_layout(showlegend=False)
-                st.plotly_chart(average_price_sqft_filtered, use_container_width=True)
-
-            # tabB Average price per deal
-            with tabB:
-                st.write("""
-                                        ##### Average price per deal:
-                                        """)
-                df_average_price_per_sold_filtered = df_filtered.groupby(['month']).apply(
-                    average_price_per_deal)
-
-                average_price_sold_filtered = px.line(df_average_price_per_sold_filtered, height=400,
-                                                      labels={
-                                                          "value": "Average price per deal/month (USD)",
-                                                          "month": "Months"}
-                                                      # ,  title='Average price per square feet per month'
-                                                      )
-                average_price_sold_filtered.update_xaxes(tickangle=45, fixedrange=True)
-                average_price_sold_filtered.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                average_price_sold_filtered.update_layout(showlegend=False)
-                st.plotly_chart(average_price_sold_filtered, use_container_width=True)
-
-            # tabC Average price per bedroom
-            with tabC:
-                st.write("""
-                                        ##### Average price per bedroom:
-                                        """)
-                df_average_price_per_bedroom_filtered = df_filtered.groupby(['month']).apply(
-                    divide_price_per_bedroom)
-
-                average_price_bedroom_filtered = px.line(df_average_price_per_bedroom_filtered, height=400,
-                                                         labels={
-                                                             "value": "Average price per bedroom/month (USD)",
-                                                             "month": "Months"}
-                                                         # ,  title='Average price per square feet per month'
-                                                         )
-                average_price_bedroom_filtered.update_xaxes(tickangle=45, fixedrange=True)
-                average_price_bedroom_filtered.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                average_price_bedroom_filtered.update_layout(showlegend=False)
-                st.plotly_chart(average_price_bedroom_filtered, use_container_width=True)
-
-            # tabD Average price per floor
-            with tabD:
-                st.write("""
-                                        ##### Average price per floor:
-                                        """)
-                df_average_price_per_floor_filtered = df_filtered.groupby(['month']).apply(
-                    divide_price_per_floor)
-
-                average_price_floor_filtered = px.line(df_average_price_per_floor_filtered, height=400,
-                                                       labels={
-                                                           "value": "Average price per floor/month (USD)",
-                                                           "month": "Months"}
-                                                       # ,  title='Average price per square feet per month'
-                                                       )
-                average_price_floor_filtered.update_xaxes(tickangle=45, fixedrange=True)
-                average_price_floor_filtered.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                average_price_floor_filtered.update_layout(showlegend=False)
-                st.plotly_chart(average_price_floor_filtered, use_container_width=True)
-
-        dataframe_average_filtered = df_filtered.groupby('month',
-                                                         as_index=True).apply(average_max_min_sqft_living)
+            st.write("Found: ", summary_filtered['records'], " records between ", summary_filtered['first_date'],
+                     " and ", summary_filtered['last_date'])
+        profile.lap('summary')
+
+        # MONTHLY METRICS FOR CHARTS AND STATISTICS
+        monthly_filtered = rerun_metrics.monthly(filtered_key)
+
+        if monthly_filtered.size > 0:
+            # only the chart the user picked is built (st.tabs would run all four)
+            chart_filtered = st.radio("Chart:", list(PRICE_CHARTS), horizontal=True, key='price-chart')
+            st.write("""
+                        ##### {}:
+                        """.format(chart_filtered))
+            monthly_chart(PRICE_CHARTS[chart_filtered], filtered_key, monthly_filtered)
+            profile.lap('price chart')
 
         # houses sold statistics:
-        if df_average_price_floor.size > 0:
-            dataframe_average_filtered = df_filtered.groupby('month',
-                                                             as_index=True).apply(
-                average_max_min_sqft_living)
+        if monthly_filtered.size > 0:
+            dataframe_average_filtered = rerun_metrics.statistics(filtered_key)
 
             st.write("""
                     ##### Houses monthly statistics:
                     """)
             st.dataframe(dataframe_average_filtered, use_container_width=True)
+            profile.payload('statistics table', lambda: profiling.dataframe_payload(dataframe_average_filtered))
+            profile.lap('statistics table')
 
-            tabE, tabF = st.tabs(["Houses sold", "Total price of sold houses"])
-
-            # tabE Houses sold
-            with tabE:
-                st.write("""
-                                        ##### Houses sold:
-                                        """)
-                # BAR CHART TOTAL NUMBER OF SOLD HOMES
-                df_total_homes_sold = df_filtered.groupby('month',
-                                                          as_index=True).apply(total_homes_sold)
-
-                bar_filtered_houses = px.bar(df_total_homes_sold, height=400,
-                                             labels={
-                                                 "value": "Sold homes",
-                                                 "month": "Months"}  # , title='Total amount of sold houses'
-                                             )
-                bar_filtered_houses.update_xaxes(tickangle=45, fixedrange=True)
-                bar_filtered_houses.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                bar_filtered_houses.update_layout(showlegend=False)
-                st.plotly_chart(bar_filtered_houses, use_container_width=True)
-
-            # tabF Total price of sold houses
-            with tabF:
-                st.write("""
-                                                           ##### Total price of sold houses:
-                                                           """)
-                # BAR CHART TOTAL PRICE OF SOLD HOMES
-                df_total_price_sold = df_filtered.groupby('month',
-                                                          as_index=True).apply(total_price_sold)
-
-                bar_filtered_total_price = px.bar(df_total_price_sold, height=400,
-                                                  labels={
-                                                      "value": "Total price",
-                                                      "month": "Months"}  # , title='Total amount of sold houses'
-                                                  )
-                bar_filtered_total_price.update_xaxes(tickangle=45, fixedrange=True)
-                bar_filtered_total_price.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-                bar_filtered_total_price.update_layout(showlegend=False)
-                st.plotly_chart(bar_filtered_total_price, use_container_width=True)
+            chart_sold = st.radio("Chart:", list(SOLD_CHARTS), horizontal=True, key='sold-chart')
+            st.write("""
+                        ##### {}:
+                        """.format(chart_sold))
+            monthly_chart(SOLD_CHARTS[chart_sold], filtered_key, monthly_filtered)
+            profile.lap('sold chart')
 
             st.write("""
                     ##### Map of the filtered houses:
                     """)
 
             # MAP OF SOLD HOUSES
-            df_filtered.rename(columns={"long": "lon"}, inplace=True)
-            st.map(df_filtered)
+            deck = map_data.map_deck(filtered_result['map'])
+            st.pydeck_chart(deck)
+            profile.payload('map', lambda: len(deck.to_json()))
+            profile.lap('map')
 
             # Filtered houses list - to download
             st.write("""
                                           ##### List of filtered houses:
                                           """)
-            df_to_display = df_filtered.drop(columns=['waterfront', 'lat', 'lon', 'month'])
+            # only the selected page is sent to the browser, a new selection starts from the first page
+            pages = export.page_count(summary_filtered['records'])
+            page = st.number_input(f"Page (of {pages}):", min_value=1, max_value=pages, value=1, step=1,
+                                   key=f'houses-page-{hash(filtered_key)}')
+            df_to_display = backend.page(filtered_key, page).drop(columns=['waterfront', 'lat', 'lon', 'month'])
             st.dataframe(df_to_display, use_container_width=True)
-
-            csv = convert_df(df_filtered)
-
-            st.download_button(
-                "Download filtered houses data",
-                csv,
-                "filtered_king_county.csv",
-                "text/csv",
-                key='download-csv'
-            )
+            profile.payload('houses page', lambda: profiling.dataframe_payload(df_to_display))
+            profile.lap('houses page')
+
+            # the csv file is written only when the user asks for it
+            compress_csv = st.checkbox("Compress the file (gzip)", key='compress-csv')
+            if st.button("Prepare filtered houses data to download", key='prepare-csv'):
+                csv = export.csv_bytes(backend.rows(filtered_key), compress=compress_csv)
+
+                st.download_button(
+                    "Download filtered houses data",
+                    csv,
+                    "filtered_king_county.csv.gz" if compress_csv else "filtered_king_county.csv",
+                    "application/gzip" if compress_csv else "text/csv",
+                    key='download-csv'
+                )
+                profile.payload('csv download', lambda: len(csv))
+                profile.lap('csv export')
 
         st.markdown("""---""")
 
@@ -330,101 +314,109 @@ with tab2:
     # CSV FILE UPLOADER
     # uploaded_file = st.sidebar.file_uploader("Upload your input CSV file", type=["csv"])
 
-    df_nonfiltered = df
-    df_nonfiltered['month'] = pd.to_datetime(df_nonfiltered['date']).dt.strftime('%Y-%m')
-
-    df_nonfiltered_grouped = df_nonfiltered.groupby(['month']).apply(divide_price_per_sqft_living)
-    df_deals = df_nonfiltered.groupby(['month']).apply(average_price_per_deal)
+    overall = overall_view(backend, data_version, generation)
 
-    if df_nonfiltered_grouped.size > 0:
+    if overall['monthly'].size > 0:
         st.subheader('How were the prices changing over the months?')
 
-        dataframe_average = df_nonfiltered.groupby(['month'], as_index=True).apply(
-            average_max_min_sqft_living)
+        st.dataframe(overall['statistics'], use_container_width=True)
 
-        st.dataframe(dataframe_average, use_container_width=True)
+        totals = overall['totals']
+        st.write("Total: ", round(totals['homes_sold']), " homes sold in a total price of: ",
+                 '${:,.2f}'.format(totals['total_price']), "")
+        st.write("Average price per deal: ", '${:,.2f}'.format(totals['average_price_per_deal']))
+        st.write("Average price per sqft living: ", '${:,.2f}'.format(totals['price_per_sqft_living']))
 
-        # TO BE ADDED LATER: functions (def)
-        st.write("Total: ", round(df_nonfiltered['id'].count()), " homes sold in a total price of: ",
-                 '${:,.2f}'.format(df_nonfiltered['price'].sum()), "")
-        st.write("Average price per deal: ",
-                 '${:,.2f}'.format(float(df_nonfiltered['price'].sum()) / float(df_nonfiltered['id'].count())))
-        st.write("Average price per sqft living: ", '${:,.2f}'.format(
-            float(df_nonfiltered['price'].sum()) / float(df_nonfiltered['sqft_living'].sum())))
+        # BAR CHART : TOTAL HOMES SOLD
+        plotly_json_chart(overall['figures']['homes_sold'])
 
-        # DATAFRAMES FOR CHARTS : APPLIED FUNCTIONS
-        df_average_price_sqft_non_filtered = df_nonfiltered.groupby(['month']).apply(
-            divide_price_per_sqft_living)
-        df_average_price_floor_non_filtered = df_nonfiltered.groupby(['month']).apply(
-            divide_price_per_floor)
-        df_average_price_bedroom_non_filtered = df_nonfiltered.groupby(['month']).apply(
-            divide_price_per_bedroom)
-        df_average_price_deal_non_filtered = df_nonfiltered.groupby(['month']).apply(
-            average_price_per_deal)
+        # monthly price charts: only the charts the user opens are rendered
+        for i, (chart, metric) in enumerate(OVERALL_PRICE_CHARTS.items()):
+            if st.checkbox(f" **{chart}** ", value=i == 0, key=f'overall-{metric}'):
+                plotly_json_chart(overall['figures'][metric])
+                profile.payload(f'overall chart {metric}', lambda: len(overall['figures'][metric]))
 
-        df_total_homes_sold_non_filtered = df_nonfiltered.groupby(['month']).apply(total_homes_sold)
+        profile.payload('overall statistics table', lambda: profiling.dataframe_payload(overall['statistics']))
+        profile.payload('overall chart homes_sold', lambda: len(overall['figures']['homes_sold']))
+    profile.lap('overall tab')
 
-        # BAR CHART : TOTAL HOMES SOLD
-        bar_total = px.bar(df_total_homes_sold_non_filtered, height=400,
-                           labels={
-                               "value": "Sold homes",
-                               "month": "Months"}, title='Total amount of sold houses'
-                           )
-        bar_total.update_xaxes(tickangle=45, fixedrange=True)
-        bar_total.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-        bar_total.update_layout(showlegend=False)
-        st.plotly_chart(bar_total, use_container_width=True)
-
-        # Average price per sqft per month expander
-        with st.expander(""
-                         " **Average price per sqft per month** "
-                         "", expanded=True):
-            average_price_sqft_not_filtered = px.line(df_average_price_sqft_non_filtered, height=400,
-                                                      labels={
-                                                          "value": "Average price sqft/month (USD)",
-                                                          "month": "Months"}
-                                                      # ,  title='Average price per square feet per month'
-                                                      )
-            average_price_sqft_not_filtered.update_xaxes(tickangle=45, fixedrange=True)
-            average_price_sqft_not_filtered.update_xaxes(dtick="M1", tickformat="%b %Y", tickangle=45)
-            average_price_sqft_not_filtered.update_layout(showlegend=False)
-            st.plotly_chart(average_price_sqft_not_filtered, use_container_width=True)
-
-        # Average price per deal per month expander
-        with st.expander(""
-                         " **Average price per deal per month** "
-                         ""):
-            average_price_deal_filtered = px.line(df_average_price_deal_non_filtered, height=400,
-                                                  labels={
-                                                      "value": "Average price deal/month (USD)",
-                                                      "date": "Months"}
-                                                  # ,markers=True,title='Average price per deal per month'
-                                                  )
-            average_price_deal_filtered.update_layout(showlegend=False)
-            st.plotly_chart(average_price_deal_filtered, use_container_width=True)
-
-        # Average price per bedroom per month expander
-        with st.expander(""
-                         " **Average price per bedroom per month** "
-                         ""):
-            average_price_bedroom_not_filtered = px.line(df_average_price_bedroom_non_filtered, height=400,
-                                                         labels={
-                                                             "value": "Average price bedroom/month (USD)",
-                                                             "date": "Months"}
-                                                         # ,markers=True, title='Average price per bedroom per month'
-                                                         )
-            average_price_bedroom_not_filtered.update_layout(showlegend=False)
-            st.plotly_chart(average_price_bedroom_not_filtered, use_container_width=True)
-
-        # Average price per floor per month expander
-        with st.expander(""
-                         " **Average price per floor per month** "
-                         ""):
-            average_price_floor_not_filtered = px.line(df_average_price_floor_non_filtered, height=400,
-                                                       labels={
-                                                           "value": "Average price floor/month (USD)",
-                                                           "date": "Months"}
-                                                       # ,   markers=True, title='Average price per floor per month'
-                                                       )
-            average_price_floor_not_filtered.update_layout(showlegend=False)
-            st.plotly_chart(average_price_floor_not_filtered, use_container_width=True)
\ No newline at end of file
+
+# COMPARABLE SALES: KD-tree of all the houses, built on the first request for comparables of a data
+# version (and generation of appended sales)
+@st.cache_resource(max_entries=2)
+def load_comparables(_backend, data_version, generation):
+    return comparables.ComparablesIndex(_backend.columns(comparables.COLUMNS))
+
+
+# comparables and price estimate of a house (id and features as a tuple), looked up only when
+# the house changes, not on every rerun of the other tabs
+@st.cache_resource(max_entries=64)
+def comparable_sales(_comparables_index, data_version, generation, house):
+    return _comparables_index.comparables(dict(house))
+
+
+# tab3 COMPARABLE SALES
+with tab3:
+    st.write("""
+    # Comparable sales
+    The sold houses most similar to a house: nearest by location, sqft living, grade and condition
+    """)
+
+    # st.tabs runs every tab on each rerun: the KD-tree (all the houses in memory, also with the
+    # DuckDB backend) is built only when a user asks for comparables
+    if st.checkbox("Find comparable sales", key='comparables-on'):
+        comparables_index = load_comparables(backend, data_version, generation)
+        houses = comparables_index.houses
+        house = None
+        search = st.radio("Comparables of:", ["A sold house", "A location"], horizontal=True,
+                          key='comparables-search')
+        if search == "A sold house":
+            house_id = st.number_input("House id:", value=int(houses['id'].iloc[0]), step=1, format='%d',
+                                       key='comparables-id')
+            sales = houses[houses['id'] == house_id]
+            if len(sales) == 0:
+                st.error("No sold house with this id")
+            else:
+                # the latest sale of the house (appended sales are not in date order)
+                house = sales.loc[sales['date'].idxmax()]
+                st.write("Sold for", '${:,.2f}'.format(house['price']), "on", house['date'].date(),
+                         ", sqft living:", house['sqft_living'], ", grade:", house['grade'],
+                         ", condition:", house['condition'])
+        else:
+            lat_column, lon_column = st.columns(2)
+            house = {'lat': lat_column.number_input("Latitude:", value=round(float(houses['lat'].median()), 4),
+                                                    format='%.4f', key='comparables-lat'),
+                     'lon': lon_column.number_input("Longitude:", value=round(float(houses['lon'].median()), 4),
+                                                    format='%.4f', key='comparables-lon'),
+                     'sqft_living': st.number_input("Sqft living:", min_value=100, value=2000, step=50,
+                                                    key='comparables-sqft'),
+                     'grade': st.slider("Grade:", 1, 13, 7, key='comparables-grade'),
+                     'condition': st.slider("Condition:", 1, 5, 3, key='comparables-condition')}
+
+        if house is not None:
+            comparable, estimate = comparable_sales(
+                comparables_index, data_version, generation,
+                tuple((column, house.get(column)) for column in ['id', 'lat', 'lon', *comparables.FEATURE_SCALES]))
+            st.write("Estimated price: ", '${:,.2f}'.format(estimate))
+            st.dataframe(comparable, use_container_width=True)
+            comparables_deck = map_data.map_deck(map_data.map_points(comparable))
+            st.pydeck_chart(comparables_deck)
+            profile.payload('comparables map', lambda: len(comparables_deck.to_json()))
+    profile.lap('comparables')
+
+# DEBUG: aggregations computed in this rerun and the results cache counters
+if debug:
+    st.sidebar.write("###### Debug: aggregations in this rerun:", rerun_metrics.aggregations)
+    with st.sidebar.expander("Admin: filtered results cache"):
+        st.write(filtered_results.stats())
+    with st.sidebar.expander("Admin: figures cache"):
+        st.write(figure_cache.stats())
+
+# PROFILE: stage timings and payloads of this rerun, also appended to the local JSONL log
+if profile.enabled:
+    profile_record = profile.record(filter_key=filtered_key, records=filtered_result['summary']['records'])
+    with st.sidebar.expander("Profile: this rerun", expanded=True):
+        st.write("Total: {:.1f} ms".format(profile_record['total_ms']))
+        st.table({'ms': profile_record['stages_ms']})
+        st.table({'bytes': profile_record['payload_bytes']})
+    profile.append_to_log(profile_record)
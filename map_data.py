@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pydeck as pdk
+
+# above this number of houses the map shows grid cells instead of single houses
+MAP_POINTS_THRESHOLD = 2000
+
+# size of a grid cell in degrees (about 1.1 km north-south, 0.75 km east-west in King County)
+CELL_SIZE = 0.01
+
+# same color as st.map
+MAP_COLOR = [200, 30, 0, 160]
+
+
+# Map payload of the houses: single houses (lat, lon, value = price) for small sets,
+# otherwise grid cells (lat, lon of the cell center, count of houses, value = median price)
+def map_points(df, threshold=MAP_POINTS_THRESHOLD, cell_size=CELL_SIZE):
+    if len(df) <= threshold:
+        # rounded to ~1 m, float32 coordinates would serialize with noise digits
+        return pd.DataFrame({'lat': df['lat'].to_numpy(dtype='float64').round(5),
+                             'lon': df['lon'].to_numpy(dtype='float64').round(5),
+                             'value': df['price'].to_numpy()})
+
+    cells = pd.DataFrame({'lat_cell': np.floor(df['lat'].to_numpy(dtype='float64') / cell_size).astype('int32'),
+                          'lon_cell': np.floor(df['lon'].to_numpy(dtype='float64') / cell_size).astype('int32'),
+                          'price': df['price'].to_numpy()})
+    grouped = cells.groupby(['lat_cell', 'lon_cell'], sort=False)['price'].agg(['size', 'median'])
+    return pd.DataFrame({'lat': (grouped.index.get_level_values('lat_cell') + 0.5) * cell_size,
+                         'lon': (grouped.index.get_level_values('lon_cell') + 0.5) * cell_size,
+                         'count': grouped['size'].to_numpy(),
+                         'value': grouped['median'].to_numpy()})
+
+
+# zoom level that fits the extent (in degrees) of the points
+def _zoom_level(extent):
+    return int(np.clip(np.log2(360 / max(extent, 1e-3)) - 1, 1, 15))
+
+
+# pydeck chart of the map payload (circle size of a cell grows with its number of houses)
+def map_deck(points, cell_size=CELL_SIZE):
+    if 'count' in points:
+        # radius in meters (evaluated in the browser), the biggest cell fills its grid square
+        radius = '{} * Math.sqrt(count / {})'.format(cell_size * 111000 / 2, points['count'].max())
+        tooltip = {'text': 'Houses: {count}\nMedian price: ${value}'}
+    else:
+        radius = 40
+        tooltip = {'text': 'Price: ${value}'}
+
+    view_state = pdk.ViewState(latitude=float(points['lat'].mean()),
+                               longitude=float(points['lon'].mean()),
+                               zoom=_zoom_level(max(np.ptp(points['lat']), np.ptp(points['lon']))))
+    layer = pdk.Layer('ScatterplotLayer', data=points, get_position=['lon', 'lat'],
+                      get_radius=radius, get_fill_color=MAP_COLOR, pickable=True)
+    return pdk.Deck(layers=[layer], initial_view_state=view_state, tooltip=tooltip)
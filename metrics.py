@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+
+import figures
+
+
+# divides the monthly sums, NaN where the divisor (or the guard column) is zero
+def _divide(numerator, denominator, guard=None):
+    guard = denominator if guard is None else guard
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where((guard > 0) & (denominator > 0), numerator / denominator, np.nan)
+
+
+# additive monthly sums the metrics are derived from
+MONTHLY_SUMS = ['homes_sold', 'price', 'sqft_living', 'floors', 'bedrooms']
+
+
+# monthly sums in one pass: np.bincount over the month codes (month is a categorical column)
+def monthly_sums(df):
+    months = df['month'].cat.categories
+    codes = df['month'].cat.codes.to_numpy()
+    size = len(months)
+
+    homes_sold = np.bincount(codes, minlength=size)
+    sums = pd.DataFrame({'homes_sold': homes_sold}, index=pd.Index(months, name='month'))
+    for column in MONTHLY_SUMS[1:]:
+        sums[column] = np.bincount(codes, weights=df[column].to_numpy(), minlength=size)
+
+    # only the months present in the data
+    return sums[homes_sold > 0]
+
+
+# monthly sums of two sets of rows (e.g. the data and a new batch), only the months of `more` change
+def add_sums(sums, more):
+    return sums.add(more, fill_value=0).sort_index().astype({'homes_sold': 'int64'})
+
+
+# the monthly metrics (ratios) from the monthly sums, whatever computed the sums
+def metrics_from_sums(sums):
+    homes_sold = sums['homes_sold'].to_numpy()
+    price = sums['price'].to_numpy(dtype='float64')
+    sqft_living = sums['sqft_living'].to_numpy(dtype='float64')
+    floors = sums['floors'].to_numpy(dtype='float64')
+    bedrooms = sums['bedrooms'].to_numpy(dtype='float64')
+
+    # same guards as the per month functions had: no value for a month without sqft living / price
+    return pd.DataFrame({
+        'homes_sold': homes_sold,
+        'total_price': np.where(price > 0, price, np.nan),
+        'total_sqft_living': sqft_living,
+        'price_per_sqft_living': _divide(price, sqft_living),
+        'price_per_floor': _divide(price, floors, guard=sqft_living),
+        'price_per_bedroom': _divide(price, bedrooms, guard=sqft_living),
+        'average_price_per_deal': np.round(_divide(price, homes_sold, guard=sqft_living)),
+    }, index=pd.Index(sums.index, name='month'))
+
+
+# all monthly metrics of the rows
+def monthly_metrics(df):
+    return metrics_from_sums(monthly_sums(df))
+
+
+# homes sold, total price, avg price per sqft, average price table
+def monthly_statistics(metrics):
+    def money(values):
+        return values.map('${:,.2f}'.format)
+
+    return pd.DataFrame({'homes sold': metrics['homes_sold'],
+                         'total price': money(metrics['total_price'].fillna(0)),
+                         'avg price per sqft': money(metrics['price_per_sqft_living']),
+                         'average price': money(metrics['average_price_per_deal'])})
+
+
+# totals of the whole period: homes sold, total price, average price per deal and per sqft living
+def overall_totals(metrics):
+    homes_sold = metrics['homes_sold'].sum()
+    total_price = metrics['total_price'].sum()
+    return {'homes_sold': homes_sold,
+            'total_price': total_price,
+            'average_price_per_deal': total_price / homes_sold,
+            'price_per_sqft_living': total_price / metrics['total_sqft_living'].sum()}
+
+
+# normalized filter state: the same selection in any order gives the same key
+def filter_key(years=(), bedrooms=(), floors=(), sqft_range=None):
+    if sqft_range is not None and not isinstance(sqft_range, tuple):
+        sqft_range = (sqft_range, sqft_range)
+    return (tuple(sorted(int(year) for year in years)),
+            tuple(sorted(int(bedroom) for bedroom in bedrooms)),
+            tuple(sorted(float(floor) for floor in floors)),
+            None if sqft_range is None else (int(sqft_range[0]), int(sqft_range[1])))
+
+
+# per rerun memo of the metrics of a query backend (see backends.py): every (filter key, metric) pair
+# is computed once and reused by all the charts, tables and headline numbers of the rerun
+class RerunMetrics:
+    def __init__(self, backend):
+        self.backend = backend
+        self._results = {}
+        self.aggregations = 0  # number of metrics actually computed in this rerun
+
+    def _get(self, key, metric, compute):
+        if (key, metric) not in self._results:
+            self._results[(key, metric)] = compute()
+            self.aggregations += 1
+        return self._results[(key, metric)]
+
+    # a metric already computed elsewhere (e.g. taken from the shared results cache)
+    def seed(self, key, metric, result):
+        self._results[(key, metric)] = result
+
+    def monthly(self, key):
+        return self._get(key, 'monthly', lambda: metrics_from_sums(self.backend.monthly_sums(key)))
+
+    def statistics(self, key):
+        return self._get(key, 'statistics', lambda: monthly_statistics(self.monthly(key)))
+
+    # number of records and the first / last sale date
+    def summary(self, key):
+        return self._get(key, 'summary', lambda: self.backend.summary(key))
+
+
+# figures of the overall tab: metric -> title (None: the default title of the metric)
+OVERALL_FIGURES = {'homes_sold': 'Total amount of sold houses',
+                   'price_per_sqft_living': None,
+                   'average_price_per_deal': None,
+                   'price_per_bedroom': None,
+                   'price_per_floor': None}
+
+
+# aggregates, headline totals and figures (as json) of the overall tab
+def overall_view(backend):
+    monthly = metrics_from_sums(backend.monthly_sums(filter_key()))
+    return {'monthly': monthly,
+            'statistics': monthly_statistics(monthly),
+            'totals': overall_totals(monthly),
+            'figures': {metric: figures.monthly_figure_json(monthly, metric, title=title)
+                        for metric, title in OVERALL_FIGURES.items()}}
+
+
+# the filtered result of a selection as cached by the app, and the json of its charts
+def filtered_view(backend, key):
+    result = {'summary': backend.summary(key),
+              'monthly': metrics_from_sums(backend.monthly_sums(key)),
+              'map': backend.map_points(key)}
+    charts = {}
+    if result['monthly'].size > 0:
+        charts = {metric: {'json': figures.monthly_figure_json(result['monthly'], metric)}
+                  for metric in figures.MONTHLY_FIGURES}
+    return result, charts
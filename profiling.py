@@ -0,0 +1,58 @@
+import datetime
+import json
+import os
+import time
+
+import pyarrow as pa
+
+# structured timing records of the reruns (one JSON per line)
+PROFILE_LOG_PATH = 'profile_log.jsonl'
+
+# size of the profile log before it is rotated to PROFILE_LOG_PATH + '.1' (replacing the previous one)
+PROFILE_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+
+# approximate bytes sent to the browser for a DataFrame (Streamlit sends it as Arrow)
+def dataframe_payload(df):
+    return pa.Table.from_pandas(df, preserve_index=True).nbytes
+
+
+# Opt-in timing of the named stages of one rerun and of the payload sent per element.
+# The script calls lap(name) at the end of every stage: the time since the previous lap
+# is added to that stage. When disabled nothing is measured.
+class RerunProfile:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.started = self._last_lap = time.perf_counter()
+        self.stages = {}
+        self.payloads = {}
+
+    def lap(self, name):
+        if self.enabled:
+            now = time.perf_counter()
+            self.stages[name] = self.stages.get(name, 0) + (now - self._last_lap) * 1000
+            self._last_lap = now
+
+    # size_function is called only when profiling, the time spent measuring is left out of the stages
+    def payload(self, element, size_function):
+        if self.enabled:
+            start = time.perf_counter()
+            self.payloads[element] = self.payloads.get(element, 0) + int(size_function())
+            self._last_lap += time.perf_counter() - start
+
+    def record(self, **fields):
+        return {'time': datetime.datetime.now().isoformat(timespec='milliseconds'),
+                'total_ms': round((time.perf_counter() - self.started) * 1000, 3),
+                'stages_ms': {name: round(ms, 3) for name, ms in self.stages.items()},
+                'payload_bytes': self.payloads,
+                **fields}
+
+    def append_to_log(self, record, path=PROFILE_LOG_PATH, max_bytes=PROFILE_LOG_MAX_BYTES):
+        try:
+            if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+                os.replace(path, path + '.1')
+            with open(path, 'a') as file:
+                file.write(json.dumps(record, default=str) + '\n')
+        except OSError:
+            # read-only file system - the record is only shown in the app
+            pass
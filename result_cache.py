@@ -0,0 +1,75 @@
+import sys
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+# default limits of the cache
+MAX_ENTRIES = 256
+MAX_BYTES = 64 * 1024 * 1024
+
+
+# approximate memory used by a cached result (dict of arrays / DataFrames)
+def result_nbytes(result):
+    nbytes = 0
+    for value in result.values():
+        if isinstance(value, np.ndarray):
+            nbytes += value.nbytes
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            nbytes += int(value.memory_usage(deep=True).sum())
+        else:
+            nbytes += sys.getsizeof(value)
+    return nbytes
+
+
+# Bounded LRU cache shared by all sessions of the process, keyed by the normalized filter state.
+# The least recently used results are evicted when there are more than max_entries results
+# or they take more than max_bytes.
+class LRUResultCache:
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._results = OrderedDict()
+        self._lock = threading.Lock()  # sessions run in separate threads
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._results:
+                self.misses += 1
+                return None
+            self._results.move_to_end(key)
+            self.hits += 1
+            return self._results[key][0]
+
+    def put(self, key, result):
+        nbytes = result_nbytes(result)
+        if nbytes > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._results:
+                self.nbytes -= self._results.pop(key)[1]
+            self._results[key] = (result, nbytes)
+            self.nbytes += nbytes
+            while len(self._results) > self.max_entries or self.nbytes > self.max_bytes:
+                self.nbytes -= self._results.popitem(last=False)[1][1]
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        with self._lock:
+            requests = self.hits + self.misses
+            return {'entries': len(self._results),
+                    'memory (MB)': round(self.nbytes / 1024 / 1024, 2),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit rate': round(self.hits / requests, 3) if requests else None,
+                    'evictions': self.evictions}
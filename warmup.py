@@ -0,0 +1,152 @@
+"""Cache warm-up before the app starts.
+
+Precomputes the overall tab and the results and charts of the most frequent filter selections
+with a process pool (one worker per core) and saves them to a local file:
+
+    $ python warmup.py --top 50
+
+The app loads the file on the first request of a worker, so the first users after a deploy get
+the same cached responses as the later ones. The file is only used for the same data (data version
+and ingested batches) and query backend it was built from.
+"""
+import argparse
+import collections
+import json
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import backends
+import ingest
+import metrics
+
+# precomputed results read by the app
+WARM_CACHE_PATH = 'warm_cache.pkl'
+
+# filter selections of the app (one JSON filter key per line), written when a selection
+# is not in the results cache; the most frequent ones are warmed up. On hosts whose file system
+# is reset on restart (Heroku dynos) point it at persistent storage, otherwise the log of the
+# previous run is lost and only the default selection is warmed up
+FILTER_LOG_PATH = os.environ.get('KING_COUNTY_FILTER_LOG', 'filter_log.jsonl')
+
+# size of the filter log before it is rotated: the full log is kept as FILTER_LOG_PATH + '.1'
+# (replacing the previous one) and a new log is started, so at most twice this size is on disk
+FILTER_LOG_MAX_BYTES = 10 * 1024 * 1024
+
+# number of filter selections warmed up
+TOP_SELECTIONS = 50
+
+def log_selection(key, path=FILTER_LOG_PATH, max_bytes=FILTER_LOG_MAX_BYTES):
+    try:
+        if os.path.exists(path) and os.path.getsize(path) >= max_bytes:
+            os.replace(path, path + '.1')
+        with open(path, 'a') as file:
+            file.write(json.dumps(key) + '\n')
+    except OSError:
+        # read-only file system - the selections are not logged
+        pass
+
+
+# the most frequent filter keys of the log (and of the rotated one)
+def top_selections(count=TOP_SELECTIONS, path=FILTER_LOG_PATH):
+    counts = collections.Counter()
+    for log_path in [path + '.1', path]:
+        if os.path.exists(log_path):
+            with open(log_path) as file:
+                for line in file:
+                    try:
+                        years, bedrooms, floors, sqft_range = json.loads(line)
+                        sqft_range = None if sqft_range is None else tuple(sqft_range)
+                        key = metrics.filter_key(years, bedrooms, floors, sqft_range)
+                    except (ValueError, TypeError):
+                        # line cut by a killed worker or a rotation
+                        continue
+                    counts[key] += 1
+    return [key for key, _ in counts.most_common(count)]
+
+
+# the selection of the app before the user changes a filter: nothing selected, whole sqft living range
+def default_selection(backend):
+    return metrics.filter_key(sqft_range=backend.sqft_bounds(metrics.filter_key()))
+
+
+# backend of the worker processes: a pandas backend is inherited from the parent when they are
+# forked, otherwise every worker loads its own (a DuckDB connection must not cross a fork)
+_worker_backend = None
+
+
+def _init_worker(backend):
+    global _worker_backend
+    _worker_backend = ingest.load_backend(backend)
+
+
+def _overall_task():
+    return metrics.overall_view(_worker_backend)
+
+
+def _filtered_task(key):
+    return key, metrics.filtered_view(_worker_backend, key)
+
+
+# computes the warm cache in a pool of `workers` processes (all the cores by default, at most
+# one per task)
+def build_warm_cache(backend=backends.BACKEND, top=TOP_SELECTIONS, workers=None):
+    global _worker_backend
+    loaded = ingest.load_backend(backend)
+    selections = [default_selection(loaded)]
+    selections.extend(key for key in top_selections(top) if key not in selections)
+
+    warm_cache = {'backend': backend,
+                  'data_version': backends.data_version(backend),
+                  'batches': sorted(loaded.batches),
+                  'generation': loaded.generation,
+                  'filtered': {},
+                  'figures': {}}
+    workers = min(workers or os.cpu_count() or 1, len(selections) + 1)
+    _worker_backend = loaded
+    if multiprocessing.get_start_method() == 'fork' and isinstance(loaded, backends.PandasBackend):
+        pool_options = {}
+    else:
+        pool_options = {'initializer': _init_worker, 'initargs': (backend,)}
+    with ProcessPoolExecutor(max_workers=workers, **pool_options) as pool:
+        overall = pool.submit(_overall_task)
+        for key, (result, charts) in pool.map(_filtered_task, selections):
+            warm_cache['filtered'][key] = result
+            warm_cache['figures'].update({(metric, key): chart for metric, chart in charts.items()})
+        warm_cache['overall'] = overall.result()
+    return warm_cache
+
+
+def write_warm_cache(warm_cache, path=WARM_CACHE_PATH):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as file:
+        pickle.dump(warm_cache, file, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+
+# the warm cache when it was built from the data of the backend, otherwise None
+def read_warm_cache(backend, data_version, path=WARM_CACHE_PATH):
+    try:
+        with open(path, 'rb') as file:
+            warm_cache = pickle.load(file)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+    if (warm_cache['backend'], warm_cache['data_version'], warm_cache['batches'], warm_cache['generation']) != \
+            (backends.BACKEND, data_version, sorted(backend.batches), backend.generation):
+        return None
+    return warm_cache
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=TOP_SELECTIONS, help='number of frequent selections warmed up')
+    parser.add_argument('--workers', type=int, help='worker processes (default: number of cores)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    cache = build_warm_cache(top=args.top, workers=args.workers)
+    write_warm_cache(cache)
+    print('Warmed up the overall tab and {} selections in {:.1f} s'.format(len(cache['filtered']),
+                                                                            time.perf_counter() - start))